@@ -1,15 +1,26 @@
 import os
+import re
+import time
+import hashlib
+import copy
+import functools
+import threading
+from bisect import bisect_right
+from itertools import accumulate
+import queue
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 import requests
-import fitz  # PyMuPDF
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
 import streamlit as st
 import base64
 from io import BytesIO
-import pandas as pd
 from datetime import datetime
 import html
 from docx import Document
 from docx.shared import Pt, Inches
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(
@@ -19,7 +30,9 @@ st.set_page_config(
 )
 
 # --- STYLING ---
-st.markdown("""
+# Streamlit drops any element a rerun doesn't re-emit, so the stylesheet has to be sent on
+# every run; keeping it a module constant at least avoids rebuilding the string.
+APP_CSS = """
 <style>
 @import url('https://fonts.googleapis.com/css2?family=Poppins:wght@400;600;700&display=swap');
 html, body, * {
@@ -59,7 +72,8 @@ h1, h2, h3, .stTitle, .stHeader {
     padding-left: 20px; margin-top: 0;
 }
 </style>
-""", unsafe_allow_html=True)
+"""
+st.markdown(APP_CSS, unsafe_allow_html=True)
 
 
 # --- API KEY & LOGO SETUP ---
@@ -70,6 +84,8 @@ except (KeyError, FileNotFoundError):
     st.error("API keys (deepseek, fmp) not found in Streamlit secrets.")
     st.stop()
 
+# cache_resource hands back the same string each rerun; cache_data would unpickle a fresh copy.
+@st.cache_resource
 def get_base64_logo_image(path="logo.png"):
     if os.path.exists(path):
         with open(path, "rb") as f:
@@ -78,6 +94,50 @@ def get_base64_logo_image(path="logo.png"):
 
 logo_base64 = get_base64_logo_image()
 
+# --- HTTP SESSION ---
+# (connect, read) timeouts: fail fast on an unreachable host, but give slow responses room.
+FMP_TIMEOUT = (5, 60)
+DEEPSEEK_TIMEOUT = (5, 120)
+
+@st.cache_resource
+def http_session():
+    """One keep-alive session for all API calls, shared across reruns and sessions to reuse TCP/TLS connections.
+
+    Rate limiting (429) and transient 5xx responses are retried with exponential backoff,
+    honouring Retry-After. urllib3 only retries those statuses for idempotent methods, so a
+    DeepSeek POST is retried on connection failures alone.
+    """
+    retry = Retry(total=5, backoff_factor=2.0, status_forcelist=[429, 500, 502, 503, 504])
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=retry))
+    return session
+
+# Each ticker/PDF runs its own fetch -> analyze pipeline on a worker thread.
+PIPELINE_MAX_WORKERS = 8
+# FMP throttles bursts, so only a few transcript fetches are in flight at a time.
+FMP_MAX_CONCURRENCY = 3
+# DeepSeek calls take seconds each; run a few at once without tripping its rate limits.
+DEEPSEEK_MAX_CONCURRENCY = 3
+DEEPSEEK_URL = "https://api.deepseek.com/chat/completions"
+# Roughly how many streamed fragments a full analysis takes; only paces the progress bar.
+DEEPSEEK_TYPICAL_CHUNKS = 800
+# API results survive restarts under .cache/<namespace>/ (see disk_cached).
+CACHE_DIR = ".cache"
+CACHE_MAX_ENTRIES = 500
+# Published transcripts don't change; the TTL only bounds how long a stale copy can linger.
+FMP_CACHE_TTL = 90 * 24 * 3600
+# A missing transcript may just not be published yet, so only remember the miss for a few hours.
+FMP_MISS_TTL = 6 * 3600
+# Only tariff-related passages are sent to DeepSeek, which keeps prompts (and latency) small.
+_TARIFF_RE = re.compile(r"\b(tariffs?|dut(?:y|ies)|import tax(?:es)?|trade war|section 301|countervailing)\b", re.IGNORECASE)
+TARIFF_EXCERPT_MAX_CHARS = 12_000
+# Without paragraph breaks, each match keeps this many characters either side (snapped to whole lines).
+TARIFF_CONTEXT_CHARS = 1_500
+# The opening (operator intro, title page) usually names the company, so it is always kept.
+TARIFF_EXCERPT_HEAD_CHARS = 1_000
+_PARAGRAPH_BREAK_RE = re.compile(r"(\n\s*\n)")
+_LINE_BREAK_RE = re.compile(r"(\r?\n)")
+
 st.markdown(
     f"""
     <div class="aranca-header">
@@ -90,50 +150,313 @@ st.markdown(
     unsafe_allow_html=True
 )
 
-# --- CORE APPLICATION LOGIC (No changes to these functions) ---
-@st.cache_data(ttl=3600)
-def get_transcript_from_fmp(ticker, year, quarter):
-    if not FMP_API_KEY:
-        st.error("Error: FMP_API_KEY not found in secrets.")
+# --- CORE APPLICATION LOGIC ---
+class PipelineError(Exception):
+    """A user-facing problem from a worker thread, shown with st.error/st.warning once the workers finish.
+
+    Streamlit's script context isn't thread-safe, so code that may run on a worker raises this
+    instead of calling st.* directly.
+    """
+    def __init__(self, message, level="error"):
+        super().__init__(message)
+        self.level = level
+
+@st.cache_resource(show_spinner=False)
+def _api_slots(api):
+    """Process-wide cap on concurrent calls to one API, shared by every session."""
+    return threading.BoundedSemaphore({"fmp": FMP_MAX_CONCURRENCY, "deepseek": DEEPSEEK_MAX_CONCURRENCY}[api])
+
+@st.cache_resource(show_spinner=False)
+def _pdf_lock():
+    """Neither PyMuPDF nor pdfium is thread-safe, so PDF parsing is serialized process-wide."""
+    return threading.Lock()
+
+def _read_cache_entry(path):
+    """Returns the stored {"ts", "data", ...} entry, or None when it is missing, unreadable or malformed."""
+    try:
+        with open(path, "rb") as f:
+            entry = orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+    if not isinstance(entry, dict) or not isinstance(entry.get("ts"), (int, float)) or "data" not in entry:
         return None
+    if not isinstance(entry.get("args", []), list):
+        return None
+    return entry
+
+def _write_cache_entry(directory, path, entry):
+    """Atomically writes one cache entry, evicting the oldest beyond CACHE_MAX_ENTRIES.
+
+    The cache is best-effort: a failed write only means the next run calls the API again.
+    """
+    payload = orjson.dumps(entry)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except OSError:
+            # Eviction only counts *.json files, so a stranded temp file would never be cleaned up.
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        entries = sorted(
+            (e for e in os.scandir(directory) if e.name.endswith(".json")),
+            key=lambda e: e.stat().st_mtime,
+        )
+        for stale in entries[:-CACHE_MAX_ENTRIES]:
+            os.remove(stale.path)
+    except OSError:
+        pass
+
+def disk_cached(namespace, ttl=None, miss=None, miss_ttl=None):
+    """Caches a function's JSON-serializable result in .cache/<namespace>/<sha256>.json.
+
+    The key is the SHA-256 of the positional arguments joined with "|"; keyword arguments
+    (callbacks) are not part of it. Entries are stored as {"ts": epoch, "data": result} and
+    expire after ttl seconds (never when ttl is None). Exceptions are not cached, except the
+    `miss` exception class: raising it stores a {"ts", "data": null, "negative": true, "args"}
+    tombstone, and until miss_ttl seconds have passed calls re-raise it with `cached = True`.
+    """
+    directory = os.path.join(CACHE_DIR, namespace)
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = hashlib.sha256("|".join(map(str, args)).encode()).hexdigest()
+            path = os.path.join(directory, f"{key}.json")
+            entry = _read_cache_entry(path)
+            if entry is not None:
+                age = time.time() - entry["ts"]
+                if entry.get("negative"):
+                    if miss is not None and (miss_ttl is None or age < miss_ttl):
+                        error = miss(*entry.get("args", ()))
+                        error.cached = True
+                        raise error
+                elif ttl is None or age < ttl:
+                    return entry["data"]
+            try:
+                data = fn(*args, **kwargs)
+            except Exception as e:
+                if miss is not None and isinstance(e, miss):
+                    _write_cache_entry(directory, path, {"ts": time.time(), "data": None, "negative": True, "args": list(e.args)})
+                raise
+            _write_cache_entry(directory, path, {"ts": time.time(), "data": data})
+            return data
+        return wrapper
+    return decorator
+
+class TranscriptNotFound(Exception):
+    """FMP answered but had no transcript; cached as a short-lived miss rather than as a transcript."""
+    cached = False
+
+@disk_cached("fmp", ttl=FMP_CACHE_TTL, miss=TranscriptNotFound, miss_ttl=FMP_MISS_TTL)
+def _fetch_fmp_transcript(ticker, year, quarter):
     url = f"https://financialmodelingprep.com/api/v3/earning_call_transcript/{ticker}?quarter={quarter}&year={year}&apikey={FMP_API_KEY}"
+    with _api_slots("fmp"):
+        response = http_session().get(url, timeout=FMP_TIMEOUT)
+    if response.status_code == 404:
+        raise TranscriptNotFound(ticker)
+    response.raise_for_status()
+    data = orjson.loads(response.content)
+    if data and "content" in data[0]:
+        return data[0]["content"]
+    raise TranscriptNotFound(ticker)
+
+def get_transcript_from_fmp(ticker, year, quarter):
+    """Returns the transcript text, raising PipelineError when it can't be fetched."""
+    if not FMP_API_KEY:
+        raise PipelineError("Error: FMP_API_KEY not found in secrets.")
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        if data and "content" in data[0]:
-            return data[0]["content"]
-        else:
-            st.warning(f"No transcript content found for {ticker} for Q{quarter} {year}.")
-            return None
+        return _fetch_fmp_transcript(ticker, year, quarter)
+    except TranscriptNotFound as e:
+        if e.cached:
+            raise PipelineError(f"{ticker}: no transcript for Q{quarter} {year} (cached; FMP is checked again within {FMP_MISS_TTL // 3600} hours).", level="info")
+        raise PipelineError(f"No transcript content found for {ticker} for Q{quarter} {year}.", level="warning")
     except requests.exceptions.RequestException as e:
-        st.error(f"Error fetching data from FMP API: {e}")
-        return None
-    except (IndexError, KeyError):
-        st.error("Error parsing FMP API response. The data might be empty or in an unexpected format.")
-        return None
+        raise PipelineError(f"Error fetching data from FMP API: {e}")
+    except (IndexError, KeyError, orjson.JSONDecodeError):
+        raise PipelineError("Error parsing FMP API response. The data might be empty or in an unexpected format.")
+
+# The prompt keeps only the first 40K characters, so stop reading well before a long PDF's tail.
+PDF_MAX_PAGES = 30
+PDF_MAX_CHARS = 50_000
+# Part of the extraction cache key: persisted text only tracks _extract_text_by_hash's own source,
+# so bump the number whenever the extractors or their text flags change.
+PDF_EXTRACTOR_VERSION = f"2:{PDF_MAX_PAGES}:{PDF_MAX_CHARS}"
+
+def _join_pages(page_texts):
+    """Joins page texts with plain "\n" line breaks, whichever library produced them.
+
+    PDFium ends lines with "\r\n" and PyMuPDF ends every page with "\n"; left as-is, the excerpting
+    would see no paragraphs at all in one and a paragraph per page in the other.
+    """
+    return "\n".join(text.replace("\r\n", "\n").rstrip("\n") for text in page_texts)
+
+# PDF libraries are imported on first use so sessions that only fetch from FMP never load them.
+@functools.cache
+def _fitz():
+    import fitz  # PyMuPDF
+    # Malformed transcripts can make MuPDF print a warning per page; that stderr noise isn't useful here.
+    fitz.TOOLS.mupdf_display_errors(False)
+    return fitz
+
+@functools.cache
+def _pdfium():
+    import pypdfium2
+    return pypdfium2
+
+def _extract_text_pdfium(pdf_file):
+    """Bulk-extracts text with pypdfium2's get_text_range(), which skips per-character boxes."""
+    pdfium = _pdfium()
+    # Given a file object, PDFium reads the pages it needs through it instead of taking a bytes copy.
+    pdf = pdfium.PdfDocument(pdf_file)
+    try:
+        page_texts = []
+        total_chars = 0
+        for i, page in enumerate(pdf):
+            if i >= PDF_MAX_PAGES or total_chars > PDF_MAX_CHARS:
+                page.close()
+                break
+            textpage = page.get_textpage()
+            page_texts.append(textpage.get_text_range())
+            total_chars += len(page_texts[-1])
+            textpage.close()
+            page.close()
+        return _join_pages(page_texts)
+    finally:
+        pdf.close()
+
+def _extract_text_fitz(pdf_file):
+    fitz = _fitz()
+    # PyMuPDF's default text flags, except that ligatures are expanded to plain letters: an "ff"
+    # ligature glyph would otherwise hide "tariffs" from the keyword excerpting.
+    text_flags = fitz.TEXTFLAGS_TEXT & ~fitz.TEXT_PRESERVE_LIGATURES
+    page_texts = []
+    total_chars = 0
+    with pdf_file.getbuffer() as view, fitz.open(stream=view, filetype="pdf") as doc:
+        for i, page in enumerate(doc):
+            if i >= PDF_MAX_PAGES or total_chars > PDF_MAX_CHARS:
+                break
+            page_texts.append(page.get_text("text", flags=text_flags))
+            total_chars += len(page_texts[-1])
+    return _join_pages(page_texts)
+
+@st.cache_data(persist="disk", max_entries=200, show_spinner=False)
+def _extract_text_by_hash(file_hash, extractor_version, _pdf_file):
+    """Extracts text once per distinct PDF and extractor version; the leading underscore makes Streamlit skip hashing _pdf_file."""
+    pdfium = _pdfium()
+    with _pdf_lock():
+        try:
+            full_text = _extract_text_pdfium(_pdf_file)
+        except pdfium.PdfiumError:
+            full_text = ""
+        # PyMuPDF copes better with unusual encodings and damaged files.
+        if not full_text.strip():
+            full_text = _extract_text_fitz(_pdf_file)
+    return full_text
 
 def extract_text_from_pdf(uploaded_file):
-    full_text = ""
+    """Returns the PDF's text, raising PipelineError when it can't be read."""
     try:
-        file_bytes = uploaded_file.getvalue()
-        with fitz.open(stream=file_bytes, filetype="pdf") as doc:
-            for page in doc:
-                full_text += page.get_text() + "\n"
+        # The upload is already in memory; hash and parse it in place rather than copying it out with getvalue().
+        with uploaded_file.getbuffer() as view:
+            file_hash = hashlib.blake2b(view, digest_size=16).hexdigest()
+        return _extract_text_by_hash(file_hash, PDF_EXTRACTOR_VERSION, uploaded_file)
     except Exception as e:
-        st.error(f"An error occurred while reading '{uploaded_file.name}': {e}")
-    return full_text
+        raise PipelineError(f"An error occurred while reading '{uploaded_file.name}': {e}")
 
-@st.cache_data(ttl=3600)
-def analyze_text_with_deepseek(text_content):
-    if not DEEPSEEK_API_KEY:
-        st.error("Error: DEEPSEEK_API_KEY not found in secrets.")
-        return None
-    if not text_content or not text_content.strip():
-        st.warning("Input text is empty. Cannot perform analysis.")
-        return None
-    prompt = f"""
-    As a specialized financial analyst, your task is to analyze the following corporate document.
+def _stream_deepseek_content(headers, data, on_delta=None):
+    """Reads a streamed DeepSeek completion, passing each content fragment to on_delta as it arrives.
+
+    Returns (content, finish_reason); the connection is released as soon as the final choice arrives.
+    """
+    chunks = []
+    finish_reason = None
+    with http_session().post(DEEPSEEK_URL, headers=headers, json=data, stream=True, timeout=DEEPSEEK_TIMEOUT) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line or not line.startswith(b"data:"):
+                continue
+            payload = line[len(b"data:"):].strip()
+            if payload == b"[DONE]":
+                break
+            choice = orjson.loads(payload)['choices'][0]
+            delta = choice['delta'].get('content')
+            if delta:
+                chunks.append(delta)
+                if on_delta is not None:
+                    on_delta(delta)
+            finish_reason = choice.get('finish_reason')
+            if finish_reason:
+                break
+    return "".join(chunks), finish_reason
+
+def _split_paragraphs(text_content, separator_re):
+    """Splits text on separator_re (one capturing group), returning start offsets and the non-blank pieces."""
+    pieces = separator_re.split(text_content)
+    offsets = list(accumulate(map(len, pieces), initial=0))
+    kept = [i for i in range(0, len(pieces), 2) if pieces[i].strip()]
+    return [offsets[i] for i in kept], [pieces[i] for i in kept]
+
+def _line_window(starts, lines, lo, hi):
+    """Widens the character range [lo, hi) to whole lines, unless that would add more than TARIFF_CONTEXT_CHARS."""
+    first = max(bisect_right(starts, lo) - 1, 0)
+    if lo - starts[first] <= TARIFF_CONTEXT_CHARS:
+        lo = starts[first]
+    last = max(bisect_right(starts, hi) - 1, 0)
+    line_end = starts[last] + len(lines[last])
+    if hi <= line_end <= hi + TARIFF_CONTEXT_CHARS:
+        hi = line_end
+    return lo, hi
+
+def _tariff_excerpt(text_content):
+    """Keeps the passages that mention tariffs, plus the document's opening for the company name.
+
+    Each matching paragraph is kept with one neighbour on each side. Transcripts without
+    blank-line paragraphs (FMP speaker turns, PDF layout lines) instead keep a window of
+    TARIFF_CONTEXT_CHARS around each match, snapped to line boundaries. Falls back to the head
+    of the document when nothing matches so the model can still report that no specifics were given.
+    """
+    # One scan over the whole document; matches are mapped back to paragraphs/lines by offset.
+    matches = [(match.start(), match.end()) for match in _TARIFF_RE.finditer(text_content)]
+    if not matches:
+        return text_content[:40000]
+    starts, paragraphs = _split_paragraphs(text_content, _PARAGRAPH_BREAK_RE)
+    if len(paragraphs) >= 3:
+        hits = {bisect_right(starts, start) - 1 for start, _ in matches}
+        keep = {j for i in hits for j in (i - 1, i, i + 1) if 0 <= j < len(paragraphs)}
+        spans = [(starts[j], starts[j] + len(paragraphs[j])) for j in keep]
+        spans.append((starts[0], starts[0] + min(len(paragraphs[0]), TARIFF_EXCERPT_HEAD_CHARS)))
+    else:
+        starts, lines = _split_paragraphs(text_content, _LINE_BREAK_RE)
+        spans = [_line_window(starts, lines, max(start - TARIFF_CONTEXT_CHARS, 0), end + TARIFF_CONTEXT_CHARS)
+                 for start, end in matches]
+        spans.append(_line_window(starts, lines, 0, TARIFF_EXCERPT_HEAD_CHARS))
+    # Merge spans that overlap or are separated only by whitespace, so "[...]" marks real gaps.
+    merged = []
+    for lo, hi in sorted(spans):
+        if merged and (lo <= merged[-1][1] or not text_content[merged[-1][1]:lo].strip()):
+            merged[-1][1] = max(merged[-1][1], hi)
+        else:
+            merged.append([lo, hi])
+    excerpt = []
+    remaining = TARIFF_EXCERPT_MAX_CHARS
+    for lo, hi in merged:
+        if remaining <= 0:
+            break
+        passage = text_content[lo:hi][:remaining]
+        remaining -= len(passage)
+        excerpt.append(passage.strip())
+    return "\n\n[...]\n\n".join(excerpt)
+
+# The instructions are identical for every document and go first as the system message, so
+# DeepSeek's prefix context cache serves them from cache on every call after the first.
+DEEPSEEK_INSTRUCTIONS = """
+    As a specialized financial analyst, your task is to analyze the corporate document provided by the user.
     Your focus must be exclusively on comments related to **tariffs, trade duties, and import taxes**.
     **Critical Rule:** You must ignore all general financial metrics (e.g., overall revenue, total orders, EBITA) unless the text explicitly states that tariffs are the cause of the financial impact. If no specific financial data related to tariffs is mentioned, the corresponding fields in your response must be an empty list `[]`.
     Extract the information and structure your response as a valid JSON object. If a specific piece of information is not mentioned, use `null` or an empty list.
@@ -145,140 +468,279 @@ def analyze_text_with_deepseek(text_content):
     - **mitigation_strategies**: A list of strings detailing the specific strategies or actions the company is taking to handle the impact of tariffs.
     - **overall_sentiment**: Your assessment of the company's sentiment regarding tariffs ("Positive", "Neutral", "Negative"). This should be based only on the tariff-related comments.
     - **summary**: A brief, one-paragraph summary of the company's position on tariffs, synthesizing ONLY the specific findings. If the document provides few specifics, your summary must state that.
-    Document Text:
+    """
+DEEPSEEK_DOCUMENT_TEMPLATE = """
+    Document Text (tariff-related excerpts; "[...]" marks omitted passages):
     ---
-    {text_content[:40000]}
+    {document_text}
     ---
     """
+
+def _check_cancelled(cancelled):
+    """Raises PipelineError if the run's cancellation event (None for uncancellable calls) is set."""
+    if cancelled is not None and cancelled.is_set():
+        raise PipelineError("Analysis cancelled.", level="warning")
+
+# st.cache_data can't record a streamed response, so completions are cached on disk, keyed by
+# the exact instructions and prompt sent: editing either template invalidates old analyses.
+@disk_cached("deepseek")
+def _complete_analysis(instructions, prompt, *, on_delta=None, cancelled=None):
+    if not DEEPSEEK_API_KEY:
+        raise PipelineError("Error: DEEPSEEK_API_KEY not found in secrets.")
     headers = {"Content-Type": "application/json", "Authorization": f"Bearer {DEEPSEEK_API_KEY}"}
-    data = {"model": "deepseek-chat", "messages": [{"role": "user", "content": prompt}], "temperature": 0.1, "response_format": {"type": "json_object"}}
+    data = {"model": "deepseek-chat", "messages": [{"role": "system", "content": instructions}, {"role": "user", "content": prompt}], "temperature": 0.1, "response_format": {"type": "json_object"}, "stream": True}
     try:
-        response = requests.post("https://api.deepseek.com/chat/completions", headers=headers, json=data, timeout=120)
-        response.raise_for_status()
-        content_str = response.json()['choices'][0]['message']['content']
-        return json.loads(content_str)
+        with _api_slots("deepseek"):
+            # The slot may have taken a while to free up; don't send a billed request for an abandoned run.
+            _check_cancelled(cancelled)
+            content_str, finish_reason = _stream_deepseek_content(headers, data, on_delta)
+        if finish_reason == "length":
+            raise PipelineError("DeepSeek response was cut off at its output token limit.")
+        return orjson.loads(content_str)
     except requests.exceptions.RequestException as e:
-        st.error(f"Error calling DeepSeek API: {e}")
-        return None
-    except (json.JSONDecodeError, KeyError) as e:
-        st.error(f"Error parsing DeepSeek API JSON response: {e}")
-        return None
+        raise PipelineError(f"Error calling DeepSeek API: {e}")
+    except (orjson.JSONDecodeError, KeyError, IndexError) as e:
+        raise PipelineError(f"Error parsing DeepSeek API JSON response: {e}")
 
-# --- UI DISPLAY & FILE GENERATION FUNCTIONS (No changes in this section) ---
-def display_tariff_report(company_name, analysis):
-    """Displays the analysis for a single company using a standardized HTML table."""
-    if not analysis:
-        st.warning(f"No analysis data to display for {company_name}.")
-        return
+def analyze_text_with_deepseek(excerpt, on_delta=None, cancelled=None):
+    """Returns the parsed tariff analysis of an excerpt from _tariff_excerpt.
 
-    st.header(f"Tariff Impact Analysis: {analysis.get('company_name', company_name)}")
-    
-    sentiment = analysis.get('overall_sentiment', 'N/A')
-    summary = analysis.get('summary', 'No summary provided.')
-    summary_html = f"""
-    <div class="report-card">
-        <h3>Executive Summary</h3>
-        <p><strong>Overall Sentiment on Tariffs:</strong> {html.escape(sentiment)}</p>
-        <p>{html.escape(summary)}</p>
-    </div>
+    Callers cut the transcript down first, so everything downstream (in-flight dedupe, cache
+    key, prompt) only ever handles the bounded excerpt. Raises PipelineError when DeepSeek
+    can't provide an analysis.
     """
-    st.markdown(summary_html, unsafe_allow_html=True)
+    if not excerpt or not excerpt.strip():
+        raise PipelineError("Input text is empty. Cannot perform analysis.", level="warning")
+    prompt = DEEPSEEK_DOCUMENT_TEMPLATE.format(document_text=excerpt)
+    return _complete_analysis(DEEPSEEK_INSTRUCTIONS, prompt, on_delta=on_delta, cancelled=cancelled)
 
-    def display_impact_table(title, impacts):
-        if not impacts:
-            st.markdown(f"""
-            <div class="report-card">
-                <h3>{title}</h3>
-                <p><i>No specific financial impacts from tariffs were mentioned in the document.</i></p>
-            </div>
-            """, unsafe_allow_html=True)
-            return
-        if isinstance(impacts, dict):
-            impacts = [impacts]
-            
-        df = pd.DataFrame(impacts)
-        df_display = df.rename(columns={
-            'metric': 'Metric',
-            'impact_value': 'Impact',
-            'unit': 'Unit',
-            'source_quote': 'Source Quote'
-        })
-        df_display = df_display.fillna('NA')
-        table_html = df_display.to_html(index=False, escape=False, border=0)
-        full_html = f"""
-        <div class="report-card">
-            <h3>{title}</h3>
-            {table_html}
-        </div>
-        """
-        st.markdown(full_html, unsafe_allow_html=True)
+def _run_pipeline(load_text, analyze, on_delta, cancelled):
+    """Loads one document and analyzes it on a worker thread; returns (had_text, analysis, error)."""
+    try:
+        _check_cancelled(cancelled)
+        text = load_text()
+    except PipelineError as e:
+        return False, None, e
+    if not text:
+        return False, None, None
+    try:
+        _check_cancelled(cancelled)
+        return True, analyze(_tariff_excerpt(text), on_delta), None
+    except PipelineError as e:
+        return True, None, e
+
+def run_analysis_pipelines(sources):
+    """Runs each {name: load_text} document through fetch/extract and DeepSeek analysis concurrently.
+
+    Returns {name: analysis} in input order for every document that produced text (None when its
+    analysis failed). Workers never touch Streamlit: they report partial output through a queue,
+    which this thread drains into one placeholder per document and a shared progress bar, and
+    their errors are shown here once they finish. Documents with identical excerpts (e.g. the
+    same PDF uploaded twice) are analyzed once. If the run is interrupted (Streamlit reruns the
+    script), this returns without waiting for the workers: queued documents are dropped, and
+    running ones stop at their next checkpoint (before fetching, before a DeepSeek request is
+    sent, or at the next streamed chunk). A fetch already on the wire finishes in the background.
+    """
+    if not sources:
+        return {}
+    deltas = queue.SimpleQueue()
+    cancelled = threading.Event()
+    progress = st.progress(0.0, text=f"Analyzed 0 of {len(sources)} documents")
+    placeholders = {name: st.empty() for name in sources}
+    partial_output = {name: [] for name in sources}
+
+    def _report_delta(name, delta):
+        _check_cancelled(cancelled)
+        deltas.put((name, delta))
+    in_flight = {}
+    in_flight_lock = threading.Lock()
+
+    def _analyze_once(excerpt, on_delta):
+        with in_flight_lock:
+            future = in_flight.get(excerpt)
+            owner = future is None
+            if owner:
+                future = in_flight[excerpt] = Future()
+        if owner:
+            try:
+                future.set_result(analyze_text_with_deepseek(excerpt, on_delta, cancelled))
+            except Exception as e:
+                # Set on the future so a duplicate waiting on it fails too instead of hanging.
+                future.set_exception(e)
+        return future.result()
+
+    results = {}
+    # Cached helpers look up the script context; the workers themselves never draw anything.
+    # Not used as a context manager: its exit would block a rerun until every worker returned.
+    executor = ThreadPoolExecutor(max_workers=min(PIPELINE_MAX_WORKERS, len(sources)),
+                                  initializer=add_script_run_ctx, initargs=(None, get_script_run_ctx()))
+    try:
+        futures = {
+            executor.submit(_run_pipeline, load_text, _analyze_once, functools.partial(_report_delta, name), cancelled): name
+            for name, load_text in sources.items()
+        }
+        pending = set(futures)
+        finished = set()
+        while pending:
+            done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+            updated = set()
+            while not deltas.empty():
+                name, delta = deltas.get()
+                partial_output[name].append(delta)
+                updated.add(name)
+            for name in updated:
+                placeholders[name].code("".join(partial_output[name]), language="json")
+            for future in done:
+                name = futures[future]
+                finished.add(name)
+                placeholders[name].empty()
+                had_text, analysis, error = future.result()
+                if error is not None:
+                    getattr(st, error.level)(str(error))
+                if had_text:
+                    results[name] = analysis
+            streaming = sum(min(len(chunks) / DEEPSEEK_TYPICAL_CHUNKS, 0.9)
+                            for name, chunks in partial_output.items() if name not in finished)
+            progress.progress((len(finished) + streaming) / len(sources),
+                              text=f"Analyzed {len(finished)} of {len(sources)} documents")
+    finally:
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+    progress.empty()
+    return {name: results[name] for name in sources if name in results}
+
+# --- UI DISPLAY & FILE GENERATION FUNCTIONS ---
+IMPACT_COLUMN_LABELS = {'metric': 'Metric', 'impact_value': 'Impact', 'unit': 'Unit', 'source_quote': 'Source Quote'}
+
+def _mitigation_sentence(strategies):
+    """Joins the strategies into one flowing sentence for the on-screen report."""
+    if len(strategies) == 1:
+        strategy_text = strategies[0]
+    elif len(strategies) == 2:
+        strategy_text = f"{strategies[0]} and {strategies[1]}"
+    else:
+        strategy_text = ", ".join(strategies[:-1]) + f", and {strategies[-1]}"
+    return f"To manage these impacts, the company is employing several strategies, including {strategy_text}."
+
+def _escaped_fields(analysis):
+    """Returns HTML-escaped copies of an analysis's free-text fields, plus the joined list fragments.
+
+    Built once and kept on the analysis under "_escaped", so the on-screen report, the comparison
+    table and the HTML download (re-rendered on every rerun) share the work. The fragments are
+    empty strings when the analysis has no qualitative impacts or strategies.
+    """
+    escaped = analysis.get('_escaped')
+    if escaped is None:
+        company_name = analysis.get('company_name')
+        qualitative_impacts = [html.escape(impact) for impact in analysis.get('qualitative_impacts') or []]
+        strategies = [html.escape(s) for s in analysis.get('mitigation_strategies') or []]
+        escaped = analysis['_escaped'] = {
+            'company_name': None if company_name is None else html.escape(company_name),
+            'overall_sentiment': html.escape(analysis.get('overall_sentiment', 'N/A')),
+            'summary': html.escape(analysis.get('summary', 'No summary provided.')),
+            'qualitative_paragraph': " ".join(qualitative_impacts),
+            'qualitative_items': "".join(f"<li>{impact}</li>" for impact in qualitative_impacts),
+            'mitigation_sentence': _mitigation_sentence(strategies) if strategies else "",
+            'mitigation_items': "".join(f"<li>{s}</li>" for s in strategies),
+        }
+    return escaped
+
+def _impact_entries(impacts):
+    """Returns an impact field as a list; the model sometimes sends a single entry instead of a list."""
+    if not impacts:
+        return []
+    return impacts if isinstance(impacts, list) else [impacts]
+
+def _impact_table_cells(impacts):
+    """Returns (header labels, rows of cell text) for an impact field, one column per key in first-seen order.
+
+    Entries are normally dicts; plain-sentence entries (which the prompt's examples invite) become
+    a Metric-only row, as the old DataFrame rendering did.
+    """
+    impacts = [impact if isinstance(impact, dict) else {'metric': str(impact)} for impact in _impact_entries(impacts)]
+    columns = list(dict.fromkeys(key for impact in impacts for key in impact))
+    header = [IMPACT_COLUMN_LABELS.get(col, str(col)) for col in columns]
+    rows = [['NA' if impact.get(col) is None else str(impact.get(col)) for col in columns] for impact in impacts]
+    return header, rows
+
+def _impact_table_html(impacts):
+    """Renders a list of impact dicts as an HTML table."""
+    header, rows = _impact_table_cells(impacts)
+    header_html = "".join(f"<th>{html.escape(label)}</th>" for label in header)
+    rows_html = "".join("<tr>" + "".join(f"<td>{html.escape(cell)}</td>" for cell in row) + "</tr>" for row in rows)
+    return f"<table><thead><tr>{header_html}</tr></thead><tbody>{rows_html}</tbody></table>"
+
+def _tariff_report_html(company_name, analysis):
+    """Renders the on-screen report cards for a single company as one HTML string."""
+    if not analysis:
+        return f'<div class="report-card"><p><i>No analysis data to display for {html.escape(company_name)}.</i></p></div>'
+
+    escaped = _escaped_fields(analysis)
+    parts = [f"<h2>Tariff Impact Analysis: {escaped['company_name'] or html.escape(company_name)}</h2>"]
 
-    display_impact_table("Quarterly Financial Impact", analysis.get('quarterly_impact'))
-    display_impact_table("Forward Guidance Impact", analysis.get('forward_guidance_impact'))
+    parts.append(
+        f'<div class="report-card"><h3>Executive Summary</h3>'
+        f'<p><strong>Overall Sentiment on Tariffs:</strong> {escaped["overall_sentiment"]}</p>'
+        f'<p>{escaped["summary"]}</p></div>'
+    )
+
+    for title, key in [("Quarterly Financial Impact", "quarterly_impact"), ("Forward Guidance Impact", "forward_guidance_impact")]:
+        impacts = analysis.get(key)
+        if not impacts:
+            parts.append(f'<div class="report-card"><h3>{title}</h3><p><i>No specific financial impacts from tariffs were mentioned in the document.</i></p></div>')
+            continue
+        parts.append(f'<div class="report-card"><h3>{title}</h3>{_impact_table_html(impacts)}</div>')
 
     # MODIFIED: Display Qualitative Impacts as a paragraph
-    qualitative_impacts = analysis.get('qualitative_impacts')
-    if qualitative_impacts:
-        # Join list items into a single paragraph
-        paragraph_text = " ".join(qualitative_impacts)
-        impacts_html = f"""
-        <div class="report-card">
-            <h3>Qualitative Impacts</h3>
-            <p>{html.escape(paragraph_text)}</p>
-        </div>
-        """
-        st.markdown(impacts_html, unsafe_allow_html=True)
+    if escaped['qualitative_paragraph']:
+        parts.append(f'<div class="report-card"><h3>Qualitative Impacts</h3><p>{escaped["qualitative_paragraph"]}</p></div>')
 
     # MODIFIED: Display Mitigation Strategies as a natural language sentence
-    strategies = analysis.get('mitigation_strategies')
-    if strategies:
-        strategy_text = ""
-        # Join the list of strategies into a flowing sentence
-        if len(strategies) == 1:
-            strategy_text = strategies[0]
-        elif len(strategies) == 2:
-            strategy_text = f"{strategies[0]} and {strategies[1]}"
-        else:
-            strategy_text = ", ".join(strategies[:-1]) + f", and {strategies[-1]}"
-        
-        full_paragraph = f"To manage these impacts, the company is employing several strategies, including {strategy_text}."
-        
-        strategies_html = f"""
-        <div class="report-card">
-            <h3>Mitigation Strategies</h3>
-            <p>{html.escape(full_paragraph)}</p>
-        </div>
-        """
-        st.markdown(strategies_html, unsafe_allow_html=True)
+    if escaped['mitigation_sentence']:
+        parts.append(f'<div class="report-card"><h3>Mitigation Strategies</h3><p>{escaped["mitigation_sentence"]}</p></div>')
+
+    return "".join(parts)
+
+def display_tariff_reports(all_analyses):
+    """Displays every company's report in a single markdown element rather than one per card."""
+    reports_html = "<hr>".join(_tariff_report_html(company, analysis) for company, analysis in all_analyses.items())
+    # A blank line (e.g. inside a source quote) would end the markdown HTML block early; HTML
+    # collapses the whitespace anyway, so flatten to a single line.
+    st.markdown(reports_html.replace("\n", " ") + "<hr>", unsafe_allow_html=True)
+
+def _impact_summary(impact):
+    if isinstance(impact, dict):
+        return f"{impact.get('metric','N/A')}: {impact.get('impact_value','N/A')}"
+    return str(impact)
 
 def create_comparison_table(all_analyses, period_source, year):
     st.header("Cross-Company Comparison")
-    comparison_data = []
+    period_html = html.escape(period_source)
+    comparison_rows = []
     for company_key, analysis in all_analyses.items():
         if not analysis: continue
-        q_impacts = analysis.get('quarterly_impact', [])
-        if isinstance(q_impacts, dict): q_impacts = [q_impacts]
-        f_impacts = analysis.get('forward_guidance_impact', [])
-        if isinstance(f_impacts, dict): f_impacts = [f_impacts]
-        q_summary = "; ".join([f"{i.get('metric','N/A')}: {i.get('impact_value','N/A')}" for i in q_impacts]) or "Not specified"
-        f_summary = "; ".join([f"{i.get('metric','N/A')}: {i.get('impact_value','N/A')}" for i in f_impacts]) or "Not specified"
+        escaped = _escaped_fields(analysis)
+        q_impacts = _impact_entries(analysis.get('quarterly_impact'))
+        f_impacts = _impact_entries(analysis.get('forward_guidance_impact'))
+        q_summary = "; ".join([html.escape(_impact_summary(i)) for i in q_impacts]) or "Not specified"
+        f_summary = "; ".join([html.escape(_impact_summary(i)) for i in f_impacts]) or "Not specified"
         total_summary_parts = []
         if q_impacts: total_summary_parts.append(f"Q2 Impact: {q_summary}")
         if f_impacts: total_summary_parts.append(f"FY{year+1} Guidance: {f_summary}")
         total_summary = "<br>".join(total_summary_parts) or "No specific impact mentioned."
-        mitigation_list = analysis.get('mitigation_strategies', [])
-        mitigation_html = "<ul>" + "".join([f"<li>{s}</li>" for s in mitigation_list]) + "</ul>" if mitigation_list else "Not specified"
-        comparison_data.append({"Company": f"<strong>{analysis.get('company_name', company_key)}</strong>", "Period / Source": period_source, "Tariff Impact Summary": total_summary, "Mitigation": mitigation_html})
-    if not comparison_data:
+        # Everything interpolated below is escaped: model output via _escaped_fields/html.escape, markup is literal.
+        mitigation_html = f"<ul>{escaped['mitigation_items']}</ul>" if escaped['mitigation_items'] else "Not specified"
+        company_html = escaped['company_name'] or html.escape(company_key)
+        comparison_rows.append(f"<tr><td><strong>{company_html}</strong></td><td>{period_html}</td><td>{total_summary}</td><td>{mitigation_html}</td></tr>")
+    if not comparison_rows:
         st.info("No data available for comparison.")
         return
-    df = pd.DataFrame(comparison_data)
-    table_html = df.to_html(index=False, escape=False, border=0)
+    table_html = f"<table><thead><tr><th>Company</th><th>Period / Source</th><th>Tariff Impact Summary</th><th>Mitigation</th></tr></thead><tbody>{''.join(comparison_rows)}</tbody></table>"
     full_html = f"""<div class="report-card"><h3>Comparison Summary</h3>{table_html}</div>"""
     st.markdown(full_html, unsafe_allow_html=True)
 
-def generate_html_report(all_analyses, period_source, year, logo_base64_string):
-    styles = """
+# Standalone copy of the page styles for the downloadable HTML report.
+REPORT_CSS = """
     <style>
         body { font-family: 'Poppins', sans-serif; }
         .report-card { background-color: #ffffff; border: 1px solid #e0e0e0; border-left: 5px solid #00416A; border-radius: 8px; padding: 20px; margin-bottom: 20px; box-shadow: 0 2px 4px rgba(0,0,0,0.05); }
@@ -292,6 +754,8 @@ def generate_html_report(all_analyses, period_source, year, logo_base64_string):
         .aranca-logo img { height: 40px; object-fit: contain; }
     </style>
     """
+
+def generate_html_report(all_analyses, period_source, year, logo_base64_string):
     header_html = f"""
     <div class="aranca-header">
         <div class="aranca-title">Tariff Impact Tracker</div>
@@ -300,44 +764,38 @@ def generate_html_report(all_analyses, period_source, year, logo_base64_string):
         </div>
     </div>
     """
-    full_html_content = f"<html><head><title>Tariff Impact Report</title>{styles}</head><body>{header_html}"
+    parts = [f"<html><head><title>Tariff Impact Report</title>{REPORT_CSS}</head><body>{header_html}"]
     for company, analysis in all_analyses.items():
         if not analysis: continue
-        full_html_content += f"<h2>Tariff Impact Analysis: {analysis.get('company_name', company)}</h2>"
-        sentiment = analysis.get('overall_sentiment', 'N/A')
-        summary = analysis.get('summary', 'No summary provided.')
-        full_html_content += f"""<div class="report-card"><h3>Executive Summary</h3><p><strong>Overall Sentiment on Tariffs:</strong> {html.escape(sentiment)}</p><p>{html.escape(summary)}</p></div>"""
+        escaped = _escaped_fields(analysis)
+        parts.append(f"<h2>Tariff Impact Analysis: {escaped['company_name'] or html.escape(company)}</h2>")
+        parts.append(f"""<div class="report-card"><h3>Executive Summary</h3><p><strong>Overall Sentiment on Tariffs:</strong> {escaped['overall_sentiment']}</p><p>{escaped['summary']}</p></div>""")
         for title, key in [("Quarterly Financial Impact", "quarterly_impact"), ("Forward Guidance Impact", "forward_guidance_impact")]:
             impacts = analysis.get(key)
             if not impacts:
-                full_html_content += f"""<div class="report-card"><h3>{title}</h3><p><i>No specific financial impacts from tariffs were mentioned.</i></p></div>"""
+                parts.append(f"""<div class="report-card"><h3>{title}</h3><p><i>No specific financial impacts from tariffs were mentioned.</i></p></div>""")
             else:
-                df = pd.DataFrame(impacts if isinstance(impacts, list) else [impacts]).fillna('NA')
-                df_display = df.rename(columns={'metric': 'Metric', 'impact_value': 'Impact', 'unit': 'Unit', 'source_quote': 'Source Quote'})
-                table_html = df_display.to_html(index=False, escape=False, border=0)
-                full_html_content += f"""<div class="report-card"><h3>{title}</h3>{table_html}</div>"""
-        qual_impacts = analysis.get('qualitative_impacts')
-        if qual_impacts:
-            full_html_content += '<div class="report-card"><h3>Qualitative Impacts</h3><ul>'
-            for impact in qual_impacts:
-                full_html_content += f"<li>{html.escape(impact)}</li>"
-            full_html_content += "</ul></div>"
-        strategies = analysis.get('mitigation_strategies')
-        if strategies:
-            full_html_content += '<div class="report-card"><h3>Mitigation Strategies</h3><ul>'
-            for s in strategies:
-                full_html_content += f"<li>{html.escape(s)}</li>"
-            full_html_content += "</ul></div>"
-        full_html_content += "<hr>"
-    full_html_content += "</body></html>"
-    return full_html_content
+                table_html = _impact_table_html(impacts)
+                parts.append(f"""<div class="report-card"><h3>{title}</h3>{table_html}</div>""")
+        if escaped['qualitative_items']:
+            parts.append(f'<div class="report-card"><h3>Qualitative Impacts</h3><ul>{escaped["qualitative_items"]}</ul></div>')
+        if escaped['mitigation_items']:
+            parts.append(f'<div class="report-card"><h3>Mitigation Strategies</h3><ul>{escaped["mitigation_items"]}</ul></div>')
+        parts.append("<hr>")
+    parts.append("</body></html>")
+    return "".join(parts)
+
+@st.cache_resource(show_spinner=False)
+def _blank_document():
+    """Loads python-docx's default template once; reports start from a copy of it."""
+    return Document()
 
 def generate_word_report(all_analyses, period_source, year):
-    doc = Document()
+    doc = copy.deepcopy(_blank_document())
     doc.add_heading('Tariff Impact Report', level=0)
     for company, analysis in all_analyses.items():
         if not analysis: continue
-        doc.add_heading(f"Analysis for: {analysis.get('company_name', company)}", level=1)
+        doc.add_heading(f"Analysis for: {analysis.get('company_name') or company}", level=1)
         doc.add_heading('Executive Summary', level=2)
         doc.add_paragraph().add_run(f"Overall Sentiment on Tariffs: {analysis.get('overall_sentiment', 'N/A')}").bold = True
         doc.add_paragraph(analysis.get('summary', 'No summary provided.'))
@@ -347,17 +805,14 @@ def generate_word_report(all_analyses, period_source, year):
             if not impacts:
                 doc.add_paragraph("No specific financial impacts from tariffs were mentioned.")
             else:
-                df = pd.DataFrame(impacts if isinstance(impacts, list) else [impacts]).fillna('NA')
-                df = df.rename(columns={'metric': 'Metric', 'impact_value': 'Impact', 'unit': 'Unit', 'source_quote': 'Source Quote'})
-                table = doc.add_table(rows=1, cols=len(df.columns))
+                header, rows = _impact_table_cells(impacts)
+                # Size the table up front and add runs to each cell's existing empty paragraph,
+                # instead of growing it row by row and resetting every cell through .text.
+                table = doc.add_table(rows=len(rows) + 1, cols=len(header))
                 table.style = 'Table Grid'
-                hdr_cells = table.rows[0].cells
-                for i, col_name in enumerate(df.columns):
-                    hdr_cells[i].text = col_name
-                for index, row in df.iterrows():
-                    row_cells = table.add_row().cells
-                    for i, cell_value in enumerate(row):
-                        row_cells[i].text = str(cell_value)
+                for row, row_values in zip(table.rows, [header, *rows]):
+                    for cell, value in zip(row.cells, row_values):
+                        cell.paragraphs[0].add_run(value)
         qual_impacts = analysis.get('qualitative_impacts')
         if qual_impacts:
             doc.add_heading('Qualitative Impacts', level=2)
@@ -391,6 +846,9 @@ if 'analysis_period' not in st.session_state:
     st.session_state.analysis_period = ""
 if 'analysis_year' not in st.session_state:
     st.session_state.analysis_year = datetime.now().year
+# (html, word) download payloads for the current results; built on first display, reset with them.
+if 'report_downloads' not in st.session_state:
+    st.session_state.report_downloads = None
 
 if data_source == "Fetch from FMP API":
     tickers_input = st.text_input("Company Ticker(s)", "AAPL, MSFT, GOOGL", help="Enter one or more tickers, separated by commas.")
@@ -405,33 +863,35 @@ if data_source == "Fetch from FMP API":
         if tickers:
             # MODIFIED: Clear previous results and update session state
             st.session_state.all_analysis_results = {}
+            st.session_state.report_downloads = None
             st.session_state.analysis_period = f"{year} Q{quarter} / Earnings Call"
             st.session_state.analysis_year = year
             
             with st.spinner("Generating analysis..."):
-                for ticker in tickers:
-                    text_to_analyze = get_transcript_from_fmp(ticker, year, quarter)
-                    if text_to_analyze:
-                        # MODIFIED: Store results in session state
-                        st.session_state.all_analysis_results[ticker] = analyze_text_with_deepseek(text_to_analyze)
+                sources = {ticker: functools.partial(get_transcript_from_fmp, ticker, year, quarter) for ticker in tickers}
+                # MODIFIED: Store results in session state
+                st.session_state.all_analysis_results = run_analysis_pipelines(sources)
 
 elif data_source == "Upload PDF Transcript(s)":
+    # Load the PDF backend now, while the user is still choosing files, rather than during the first analysis.
+    _pdfium()
     uploaded_files = st.file_uploader("Upload one or more PDF files", type="pdf", accept_multiple_files=True)
     
     if st.button("Upload & Analyze PDFs", type="primary"):
         if uploaded_files:
             # MODIFIED: Clear previous results and update session state
             st.session_state.all_analysis_results = {}
+            st.session_state.report_downloads = None
             st.session_state.analysis_period = "Uploaded Docs"
             st.session_state.analysis_year = datetime.now().year
             
             with st.spinner("Generating analysis..."):
-                for uploaded_file in uploaded_files:
-                    company_name = os.path.splitext(uploaded_file.name)[0]
-                    text_to_analyze = extract_text_from_pdf(uploaded_file)
-                    if text_to_analyze:
-                        # MODIFIED: Store results in session state
-                        st.session_state.all_analysis_results[company_name] = analyze_text_with_deepseek(text_to_analyze)
+                sources = {
+                    os.path.splitext(uploaded_file.name)[0]: functools.partial(extract_text_from_pdf, uploaded_file)
+                    for uploaded_file in uploaded_files
+                }
+                # MODIFIED: Store results in session state
+                st.session_state.all_analysis_results = run_analysis_pipelines(sources)
         else:
             st.warning("Please upload at least one PDF file.")
 
@@ -441,9 +901,7 @@ if st.session_state.all_analysis_results:
     st.markdown("---")
     
     # Display the results on the page
-    for company, analysis in st.session_state.all_analysis_results.items():
-        display_tariff_report(company, analysis)
-        st.markdown("---")
+    display_tariff_reports(st.session_state.all_analysis_results)
     
     if len(st.session_state.all_analysis_results) > 1:
         create_comparison_table(st.session_state.all_analysis_results, st.session_state.analysis_period, st.session_state.analysis_year)
@@ -451,9 +909,13 @@ if st.session_state.all_analysis_results:
     st.markdown("---")
     st.header("Download Report")
 
-    # Prepare content for download buttons
-    html_content = generate_html_report(st.session_state.all_analysis_results, st.session_state.analysis_period, st.session_state.analysis_year, logo_base64)
-    word_buffer = generate_word_report(st.session_state.all_analysis_results, st.session_state.analysis_period, st.session_state.analysis_year)
+    # Prepare content for download buttons once per set of results, not on every rerun
+    if st.session_state.report_downloads is None:
+        st.session_state.report_downloads = (
+            generate_html_report(st.session_state.all_analysis_results, st.session_state.analysis_period, st.session_state.analysis_year, logo_base64),
+            generate_word_report(st.session_state.all_analysis_results, st.session_state.analysis_period, st.session_state.analysis_year).getvalue(),
+        )
+    html_content, word_bytes = st.session_state.report_downloads
 
     # Create columns for download buttons
     col1, col2 = st.columns(2)
@@ -469,7 +931,7 @@ if st.session_state.all_analysis_results:
     with col2:
         st.download_button(
             label="📄 Download as Word",
-            data=word_buffer,
+            data=word_bytes,
             file_name="tariff_impact_report.docx",
             mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
         )
\ No newline at end of file